@@ -1,172 +1,773 @@
+import quart_flask_patch  # noqa: F401 -- must run before the Flask extensions are imported
+import asyncio
+import contextlib
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+import re
+import hashlib
+import hmac
+import json
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from threading import Lock
+from quart import Quart, Response, render_template, request, jsonify, redirect, url_for, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
 import fitz
+import numpy as np
 import google.generativeai as genai
+from redis import Redis
+from rq import Queue
+from rq.job import JobStatus
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app = Quart(__name__)
+app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
+if not app.config['SECRET_KEY']:
+    # Fine for a single dev process; with several workers, logins would only work on the one that signed them.
+    app.logger.warning("SECRET_KEY is not set; using a random per-process key, so sessions won't survive restarts.")
+    app.config['SECRET_KEY'] = os.urandom(24)
+# SQLite by default; point DATABASE_URL at Postgres (postgresql+psycopg://...) in production.
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", 'sqlite:///users.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"pool_pre_ping": True}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite"):
+    # Sized for a server database; in-memory SQLite uses a StaticPool, which rejects these options.
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=10, max_overflow=20)
+# Larger uploads are rejected with 413 before the body is buffered.
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+# Cost 12 (~250 ms per hash) in production; set BCRYPT_ROUNDS=4 for dev/test.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv("BCRYPT_ROUNDS", 12))
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers proceed during a write, which matters once several workers share the file."""
+    if not isinstance(dbapi_connection, sqlite3.Connection): return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+# All Gemini calls go through the *_async methods, so pin them to gRPC over asyncio: one
+# persistent HTTP/2 channel per worker, multiplexing every in-flight request.
+genai.configure(api_key=os.getenv("GEMINI_API_KEY"), transport="grpc_asyncio")
+
+FLASH_MODEL_NAME = 'gemini-1.5-flash-latest'
+FLASH_MODEL = genai.GenerativeModel(FLASH_MODEL_NAME)
+
+@lru_cache(maxsize=128)
+def flash_model(system_instruction=None):
+    """Returns the shared model, or one built once per distinct system instruction."""
+    if system_instruction is None: return FLASH_MODEL
+    return genai.GenerativeModel(FLASH_MODEL_NAME, system_instruction=system_instruction)
+
+# --- LLM RESPONSE CACHE ---
+def cache_key(text, prefix=b""):
+    """BLAKE2b-128 hex digest used for cache keys; prefix (a digest) keys the hash to an invariant head."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16, key=prefix).hexdigest()
+
+@lru_cache(maxsize=256)
+def prefix_digest(*parts):
+    """Hashes a prompt's invariant head (model name, system instruction) once per process."""
+    return hashlib.blake2b("\0".join(part or "" for part in parts).encode("utf-8"), digest_size=32).digest()
+
+class LLMCache:
+    """In-memory LRU of Gemini responses keyed by a BLAKE2b hash of model name + prompt.
+
+    Misses are coalesced: while a prompt is being generated, identical requests wait for that
+    call instead of starting their own. A shared semaphore caps concurrent Gemini calls.
+    """
+
+    def __init__(self, model_name, get_model, maxsize=2048, max_concurrency=32):
+        self.model_name = model_name
+        self.get_model = get_model
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._in_flight = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def key(self, prompt, system_instruction=None):
+        return cache_key(prompt, prefix_digest(self.model_name, system_instruction))
+
+    def get(self, prompt, system_instruction=None):
+        key = self.key(prompt, system_instruction)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, prompt, text, system_instruction=None):
+        key = self.key(prompt, system_instruction)
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def _call(self, prompt, system_instruction):
+        async with self._semaphore:
+            response = await self.get_model(system_instruction).generate_content_async(prompt)
+        self.set(prompt, response.text, system_instruction)
+        return response.text
+
+    async def generate(self, prompt, system_instruction=None):
+        key = self.key(prompt, system_instruction)
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+        else:
+            pending = asyncio.ensure_future(self._call(prompt, system_instruction))
+            self._in_flight[key] = pending
+            pending.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so one caller going away doesn't cancel the call for the others.
+        return await asyncio.shield(pending)
+
+    async def generate_stream(self, prompt, system_instruction=None):
+        """Yields response chunks as Gemini produces them; caches the full text once complete.
+
+        Identical requests arriving mid-stream receive the full text in one chunk when it's done.
+        """
+        key = self.key(prompt, system_instruction)
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            yield await asyncio.shield(pending)
+            return
+        pending = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = pending
+        parts = []
+        try:
+            async with self._semaphore:
+                async for chunk in await self.get_model(system_instruction).generate_content_async(prompt, stream=True):
+                    parts.append(chunk.text)
+                    yield chunk.text
+            text = "".join(parts)
+            self.set(prompt, text, system_instruction)
+            pending.set_result(text)
+        except BaseException as e:
+            pending.set_exception(e if isinstance(e, Exception) else RuntimeError("Gemini stream was interrupted"))
+            pending.exception()  # mark retrieved; there may be no followers to see it
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def get_or_generate(self, prompt, system_instruction=None):
+        text = self.get(prompt, system_instruction)
+        return text if text is not None else await self.generate(prompt, system_instruction)
+
+    async def stream(self, prompt, system_instruction=None):
+        text = self.get(prompt, system_instruction)
+        if text is not None:
+            yield text
+        else:
+            async for part in self.generate_stream(prompt, system_instruction):
+                yield part
+
+llm_cache = LLMCache(FLASH_MODEL_NAME, flash_model, max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 32)))
+
+# --- SEMANTIC CACHE ---
+class _ScopeIndex:
+    """Up to `capacity` embeddings in a preallocated matrix that grows in doubling blocks.
+
+    Once full, new rows overwrite the oldest one (a ring buffer), so an insert never copies the scope.
+    Rows are unique by key: storing a key again updates its row in place.
+    """
+
+    def __init__(self, dim, capacity, block=64):
+        self.capacity = capacity
+        self.matrix = np.empty((min(block, capacity), dim), dtype=np.float32)
+        self.keys = []
+        self.responses = []
+        self._slots = {}
+        self._next = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, embedding, response):
+        """Stores a row and returns the key it evicted, if any."""
+        slot = self._slots.get(key)
+        if slot is not None:
+            self.matrix[slot] = embedding
+            self.responses[slot] = response
+            return None
+        size = len(self.keys)
+        if size < self.capacity:
+            if size == len(self.matrix):
+                grown = np.empty((min(2 * size, self.capacity), self.matrix.shape[1]), dtype=np.float32)
+                grown[:size] = self.matrix
+                self.matrix = grown
+            self.matrix[size] = embedding
+            self.keys.append(key)
+            self.responses.append(response)
+            self._slots[key] = size
+            return None
+        slot = self._next
+        self._next = (slot + 1) % self.capacity
+        evicted = self.keys[slot]
+        del self._slots[evicted]
+        self._slots[key] = slot
+        self.matrix[slot] = embedding
+        self.keys[slot] = key
+        self.responses[slot] = response
+        return evicted
+
+    def similarities(self, embedding):
+        return self.matrix[:len(self.keys)] @ embedding
+
+class SemanticCache:
+    """Reuses answers for paraphrased queries by cosine similarity of their embeddings.
+
+    Embeddings are kept L2-normalised in one float32 matrix per scope (e.g. course title),
+    so a lookup is a single matrix-vector product. Each scope keeps its newest max_entries
+    rows, in memory and in SQLite.
+    """
+
+    def __init__(self, llm_cache, path, threshold=0.92, embed_model="models/text-embedding-004", max_entries=2048):
+        self.llm_cache = llm_cache
+        self.threshold = threshold
+        self.embed_model = embed_model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scopes = {}
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS semantic_cache "
+                           "(key TEXT PRIMARY KEY, scope TEXT, embedding BLOB, response TEXT, ts REAL)")
+        # Trim every scope to its newest rows first, so workers only load what they can keep.
+        self._conn.execute("DELETE FROM semantic_cache WHERE key IN (SELECT key FROM "
+                           "(SELECT key, ROW_NUMBER() OVER (PARTITION BY scope ORDER BY ts DESC) AS n FROM semantic_cache) "
+                           "WHERE n > ?)", (max_entries,))
+        self._conn.commit()
+        for key, scope, blob, response in self._conn.execute("SELECT key, scope, embedding, response FROM semantic_cache ORDER BY ts"):
+            self._append(scope, key, np.frombuffer(blob, dtype=np.float32), response)
+
+    def _append(self, scope, key, embedding, response):
+        index = self._scopes.get(scope)
+        if index is None:
+            index = self._scopes[scope] = _ScopeIndex(embedding.size, self.max_entries)
+        return index.add(key, embedding, response)
+
+    async def _embed(self, text):
+        result = await genai.embed_content_async(model=self.embed_model, content=text)
+        vector = np.asarray(result["embedding"], dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _lookup(self, scope, embedding):
+        with self._lock:
+            index = self._scopes.get(scope)
+            if index is not None:
+                similarities = index.similarities(embedding)
+                best = int(similarities.argmax())
+                if similarities[best] > self.threshold:
+                    self.hits += 1
+                    return index.responses[best]
+            self.misses += 1
+        return None
+
+    def _store(self, scope, embedding, prompt, text, system_instruction):
+        key = self.llm_cache.key(prompt, system_instruction)
+        with self._lock:
+            evicted = self._append(scope, key, embedding, text)
+            if evicted is not None:
+                self._conn.execute("DELETE FROM semantic_cache WHERE key = ?", (evicted,))
+            self._conn.execute("INSERT OR REPLACE INTO semantic_cache VALUES (?, ?, ?, ?, ?)",
+                               (key, scope, embedding.tobytes(), text, time.time()))
+            self._conn.commit()
+
+    async def stream(self, scope, query, prompt, system_instruction=None):
+        text = self.llm_cache.get(prompt, system_instruction)
+        if text is None:
+            embedding = await self._embed(query)
+            text = self._lookup(scope, embedding)
+        if text is not None:
+            yield text
+            return
+        parts = []
+        async for part in self.llm_cache.generate_stream(prompt, system_instruction):
+            parts.append(part)
+            yield part
+        # Callers coalesced onto the same generation store under the same key, refreshing one row.
+        self._store(scope, embedding, prompt, "".join(parts), system_instruction)
+
+semantic_cache = None
+if os.getenv("SEMANTIC_CACHE") == "1":
+    os.makedirs(app.instance_path, exist_ok=True)
+    semantic_cache = SemanticCache(llm_cache, os.path.join(app.instance_path, "semantic_cache.db"))
+
+def sse_response(chunks):
+    """Streams text chunks (an async iterable) to the browser as Server-Sent Events of the form {"delta": ...}."""
+    @stream_with_context
+    async def events():
+        try:
+            async for delta in chunks:
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    return Response(events(), mimetype='text/event-stream')
+
+# --- PDF TEXT EXTRACTION ---
+# MuPDF is not thread-safe, so large documents are split into page ranges that are
+# extracted in separate processes, each opening its own copy of the document. Documents that
+# fit in one range (or single-CPU hosts) are extracted inline: a pool would only add a fork.
+PDF_PAGES_PER_WORKER = 16
+# Plain text only: ligatures are expanded and no post-processing beyond whitespace is kept.
+PDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+# Pages whose content streams take more than this many bytes as stored (usually Flate-compressed,
+# several times smaller than inflated) are copied into a standalone document first, which avoids
+# MuPDF walking the source document's structure tree during extraction.
+PDF_ISOLATE_PAGE_BYTES = 500_000
+PDF_MAGIC = b"%PDF-"
+PDF_COPY_CHUNK = 1024 * 1024
+# Roughly 50k tokens; longer documents are trimmed before any Gemini call.
+PDF_CHAR_BUDGET = 200_000
+
+def _page_text(pdf_document, page_number):
+    """Returns (text, stored content stream size) for one page."""
+    page = pdf_document[page_number]
+    # Raw (still compressed) lengths: only a size threshold is needed, so nothing is inflated here.
+    content_size = sum(len(pdf_document.xref_stream_raw(xref)) for xref in page.get_contents())
+    if content_size <= PDF_ISOLATE_PAGE_BYTES:
+        return page.get_text("text", flags=PDF_TEXT_FLAGS), content_size
+    with fitz.open() as single_page:
+        single_page.insert_pdf(pdf_document, from_page=page_number, to_page=page_number,
+                               links=False, annots=False, widgets=False)
+        return single_page[0].get_text("text", flags=PDF_TEXT_FLAGS), content_size
+
+def _extract_page_range(pdf_path, start, stop):
+    with fitz.open(pdf_path) as pdf_document:
+        return [_page_text(pdf_document, i) for i in range(start, stop)]
+
+def extract_pdf_pages(pdf_path):
+    cpus = os.cpu_count() or 1
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
+        if page_count <= PDF_PAGES_PER_WORKER or cpus < 2:
+            return [_page_text(pdf_document, i) for i in range(page_count)]
+    starts = range(0, page_count, PDF_PAGES_PER_WORKER)
+    stops = [min(start + PDF_PAGES_PER_WORKER, page_count) for start in starts]
+    # A pool per call: the RQ work-horse exits via os._exit, so a long-lived pool would never be
+    # shut down and its processes would be orphaned after every job.
+    with ProcessPoolExecutor(max_workers=min(cpus, len(starts))) as pool:
+        ranges = list(pool.map(_extract_page_range, [pdf_path] * len(starts), starts, stops))
+    return [page for page_range in ranges for page in page_range]
+
+def spool_upload(stream, destination):
+    """Copies an upload to destination in 1 MB chunks, returning a BLAKE2b digest of its bytes."""
+    hasher = hashlib.blake2b(digest_size=16)
+    while chunk := stream.read(PDF_COPY_CHUNK):
+        hasher.update(chunk)
+        destination.write(chunk)
+    destination.flush()
+    return hasher.hexdigest()
+
+def fit_to_budget(pages, budget):
+    """Joins page texts, dropping pages once the total would exceed budget characters.
+
+    The first and last pages are kept first, then the remaining budget goes to the pages with
+    the most text per byte of content stream; the kept pages stay in document order.
+    """
+    if sum(len(text) for text, _ in pages) <= budget:
+        return "".join(text for text, _ in pages)
+    middle = sorted(range(1, len(pages) - 1), key=lambda i: len(pages[i][0]) / max(pages[i][1], 1), reverse=True)
+    kept, remaining = set(), budget
+    for i in dict.fromkeys([0, len(pages) - 1] + middle):
+        if len(pages[i][0]) <= remaining:
+            kept.add(i)
+            remaining -= len(pages[i][0])
+    if not kept:
+        return "".join(text for text, _ in pages)[:budget]
+    return "".join(pages[i][0] for i in sorted(kept))
+
+# --- PDF SUMMARY CACHE ---
+class SummaryCache:
+    """Finished PDF summaries on disk, keyed by a hash of the uploaded bytes and shared by all workers."""
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _remove(self, path):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self._remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def prune(self):
+        """Deletes expired summaries (and temp files left by interrupted writes) never read again."""
+        cutoff = time.time() - self.ttl
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < cutoff: self._remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def set(self, key, text):
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directory, delete=False) as f:
+            f.write(text)
+        os.replace(f.name, self._path(key))
+        # Writes happen once per finished job, so a directory scan here is cheap enough.
+        self.prune()
+
+summary_cache = SummaryCache(os.path.join(app.instance_path, "summaries"), ttl=7 * 86400)
+
+# --- DOCUMENT SUMMARIZATION ---
+# Long documents are summarized map-reduce style: each ~8k-token window is summarized
+# concurrently, then the partial summaries are merged by a final (streamed) call.
+SUMMARY_CHUNK_TOKENS = 8000
+SUMMARY_MAP_WORKERS = 8
+
+def chunk_text(text, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """Splits text into windows of roughly max_tokens (estimated as len // 4), preferring line breaks."""
+    max_chars = max_tokens * 4
+    chunks = []
+    while len(text) > max_chars:
+        cut = text.rfind("\n", 0, max_chars)
+        if cut <= 0: cut = max_chars
+        chunks.append(text[:cut])
+        text = text[cut:]
+    chunks.append(text)
+    return chunks
+
+async def summarize_document(full_text):
+    chunks = chunk_text(full_text)
+    if len(chunks) == 1:
+        async for part in llm_cache.stream(f"Summarize the following document into key bullet points:\n\n{full_text}"):
+            yield part
+        return
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_WORKERS)
+
+    async def summarize_chunk(chunk):
+        async with semaphore:
+            return await llm_cache.get_or_generate(f"Summarize this section of a larger document into key bullet points:\n\n{chunk}")
+
+    partials = await asyncio.gather(*(summarize_chunk(chunk) for chunk in chunks))
+    joined = "\n\n".join(partials)
+    async for part in llm_cache.stream(f"Combine these partial summaries into unified bullet points:\n\n{joined}"):
+        yield part
+
+# --- BACKGROUND SUMMARY JOBS ---
+# PDF summaries run in an RQ worker (`rq worker summaries`) so uploads return immediately.
+# Jobs are identified by the upload's content hash: identical uploads share one job, and the
+# finished summary is read back from summary_cache. Workers must share the instance folder.
+UPLOAD_DIR = os.path.join(app.instance_path, "uploads")
+SUMMARY_JOB_TIMEOUT = 600
+# A job still queued after this long most likely means no `rq worker summaries` is running;
+# it is cancelled and reported as failed rather than left pending forever.
+SUMMARY_QUEUE_TIMEOUT = 300
+# How long an upload's hash stays claimed by its job, covering time spent waiting in the queue.
+SUMMARY_CLAIM_TTL = 3600
+PENDING_JOB_STATUSES = (JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED)
+summary_queue = Queue("summaries", connection=Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+
+@lru_cache(maxsize=None)
+def job_loop():
+    # One loop per worker process; the gRPC channel to Gemini is bound to the loop that opened it.
+    return asyncio.new_event_loop()
+
+async def _collect(chunks):
+    return "".join([part async for part in chunks])
+
+def _claim_name(key):
+    return f"summary-claim:{key}"
+
+def _upload_path(key):
+    return os.path.join(UPLOAD_DIR, f"{key}.pdf")
+
+def run_summary(pdf_path, key):
+    """RQ job: extracts and summarizes an uploaded PDF, leaving the result in summary_cache."""
+    try:
+        try:
+            full_text = fit_to_budget(extract_pdf_pages(pdf_path), PDF_CHAR_BUDGET)
+        finally:
+            os.remove(pdf_path)
+        if full_text.strip():
+            summary = job_loop().run_until_complete(_collect(summarize_document(full_text)))
+        else:
+            summary = "This PDF contains no text to summarize."
+        summary_cache.set(key, summary)
+    finally:
+        summary_queue.connection.delete(_claim_name(key))
+
+def enqueue_summary(spooled_path, key):
+    """Queues run_summary for an upload unless a job for the same bytes is already pending.
+
+    The content hash is claimed with SET NX, so concurrent identical uploads share one job and
+    the losers' spooled copies are discarded. Returns the task id.
+    """
+    connection = summary_queue.connection
+    if not connection.set(_claim_name(key), 1, nx=True, ex=SUMMARY_CLAIM_TTL):
+        os.remove(spooled_path)
+        return key
+    pdf_path = _upload_path(key)
+    try:
+        os.replace(spooled_path, pdf_path)
+        summary_queue.enqueue(run_summary, pdf_path, key, job_id=key, job_timeout=SUMMARY_JOB_TIMEOUT)
+    except Exception:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(pdf_path)
+        connection.delete(_claim_name(key))
+        raise
+    return key
+
+def summary_job_status(key):
+    job = summary_queue.fetch_job(key)
+    if job is None: return None
+    status = job.get_status()
+    if (status == JobStatus.QUEUED and job.enqueued_at is not None
+            and time.time() - job.enqueued_at.timestamp() > SUMMARY_QUEUE_TIMEOUT):
+        job.cancel()
+        summary_queue.connection.delete(_claim_name(key))
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_upload_path(key))
+        return JobStatus.CANCELED
+    return status
 
 # --- DATABASE MODEL ---
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(100), unique=True, nullable=False)
+    email = db.Column(db.String(100), unique=True, nullable=False, index=True)
     password = db.Column(db.String(60), nullable=False)
 
+# Built once and reused; goes straight to the unique email index.
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+
+def find_user(email):
+    return db.session.execute(USER_BY_EMAIL, {"email": email}).scalar_one_or_none()
+
+@lru_cache(maxsize=10_000)
+def user_exists(email):
+    """Signup collision check; cleared on every new signup so a cached miss can't go stale."""
+    return find_user(email) is not None
+
 # --- ROADMAP DATA ---
-ROADMAP_DATA = {
-    "web-dev": {
-        "title": "Full Stack Web Development",
-        "description": "This path provides a comprehensive journey from frontend aesthetics to backend logic, preparing you to build and deploy complete web applications.",
-        "steps": [
-            {"title": "Module 1: Foundations - HTML, CSS, & Git", "description": "Learn the core structure of web pages with HTML, style them with CSS, and manage your code with Git version control."},
-            {"title": "Module 2: JavaScript Fundamentals", "description": "Master the programming language of the web for interactive and dynamic content."},
-            {"title": "Module 3: Frontend Frameworks (React)", "description": "Build modern, fast, and scalable user interfaces by learning the component-based architecture of React."},
-            {"title": "Module 4: Backend Development (Python & Flask)", "description": "Create powerful servers, RESTful APIs, and handle server-side logic using the Flask framework."},
-            {"title": "Module 5: Databases & SQL", "description": "Learn to design, manage, and query relational databases to store and retrieve application data effectively."},
-            {"title": "Module 6: Deployment & Cloud Basics", "description": "Understand how to take your application live using cloud services and basic DevOps principles."}
-        ],
-        "jobs": ["Frontend Developer", "Backend Developer", "Full Stack Developer", "Web Application Engineer"]
-    },
-    "ml-eng": { "title": "Machine Learning Engineer", "description": "This path covers the essential skills for a career in Artificial Intelligence.", "steps": [], "jobs": ["Machine Learning Engineer", "Data Scientist", "AI Developer"] },
-    "devops": { "title": "Cloud & DevOps Engineer", "description": "Learn to automate, deploy, and scale modern software applications in the cloud.", "steps": [], "jobs": ["DevOps Engineer", "Cloud Engineer", "Site Reliability Engineer (SRE)"] }
-}
+with open(os.path.join(app.root_path, "data", "roadmaps.json"), encoding="utf-8") as f:
+    ROADMAP_DATA = json.load(f)
+
+# Roadmap pages are static, so each is rendered once at startup and served with a strong ETag.
+ROADMAP_PAGES = {}
+
+@app.before_serving
+async def render_roadmaps():
+    for course_id, roadmap in ROADMAP_DATA.items():
+        html = await render_template("roadmap.html", roadmap=roadmap)
+        ROADMAP_PAGES[course_id] = (html, cache_key(html))
+
+# --- LOGIN CACHE ---
+# Successful logins are remembered for a short while so retry storms don't repeat bcrypt.
+# Keys use an HMAC of the password with a per-process pepper, so no reusable digest is held,
+# and entries carry the stored hash so a password change invalidates them immediately.
+LOGIN_CACHE_TTL = 60
+LOGIN_CACHE_PEPPER = os.urandom(32)
+_login_cache = {}
+
+def _login_cache_key(email, password):
+    return email, hmac.new(LOGIN_CACHE_PEPPER, password.encode("utf-8"), hashlib.sha256).hexdigest()
+
+async def check_login(email, password):
+    user = find_user(email)
+    if not user or not password: return None
+    key, now = _login_cache_key(email, password), time.monotonic()
+    cached = _login_cache.get(key)
+    if cached and cached[0] == user.password and cached[1] > now: return user
+    # bcrypt releases the GIL, so hashing in a thread keeps the event loop serving other requests.
+    if not await asyncio.to_thread(bcrypt.check_password_hash, user.password, password): return None
+    if len(_login_cache) > 1024:
+        for stale in [k for k, (_, expires) in _login_cache.items() if expires <= now]:
+            _login_cache.pop(stale, None)
+    _login_cache[key] = (user.password, now + LOGIN_CACHE_TTL)
+    return user
 
 @app.cli.command("init-db")
 def init_db():
-    with app.app_context():
-        db.create_all()
+    # Quart's app context is async-only, so enter it from a short-lived event loop.
+    async def create_all():
+        async with app.app_context():
+            db.create_all()
+    asyncio.run(create_all())
     print("Initialized the database.")
 
 # --- PAGE ROUTES ---
 @app.route("/")
-def index(): return render_template("login.html")
+async def index(): return await render_template("login.html")
 
 @app.route("/courses")
-def courses():
+async def courses():
     if 'user_id' not in session: return redirect(url_for('index'))
-    return render_template("courses.html")
+    return await render_template("courses.html")
 
 @app.route("/course/<course_id>")
-def course_roadmap(course_id):
+async def course_roadmap(course_id):
     if 'user_id' not in session: return redirect(url_for('index'))
-    roadmap = ROADMAP_DATA.get(course_id)
-    if not roadmap: return "Course not found!", 404
-    return render_template("roadmap.html", roadmap=roadmap)
+    page = ROADMAP_PAGES.get(course_id)
+    if not page: return "Course not found!", 404
+    html, etag = page
+    # private: the page sits behind login, so shared caches must not serve it.
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, max-age=3600"}
+    if request.if_none_match.contains(etag): return Response("", status=304, headers=headers)
+    return Response(html, headers=headers)
 
 @app.route("/chat")
-def chat():
+async def chat():
     if 'user_id' not in session: return redirect(url_for('index'))
-    return render_template("chat.html")
+    return await render_template("chat.html")
 
 # --- AUTHENTICATION ROUTES ---
 @app.route("/signup", methods=["POST"])
-def signup():
-    name, email, password = request.form.get('name'), request.form.get('email'), request.form.get('password')
-    if User.query.filter_by(email=email).first():
-        return render_template("login.html", error="Email already registered.", form='signup')
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+async def signup():
+    form = await request.form
+    name, email, password = form.get('name'), form.get('email'), form.get('password')
+    if user_exists(email):
+        return await render_template("login.html", error="Email already registered.", form='signup')
+    hashed_password = (await asyncio.to_thread(bcrypt.generate_password_hash, password)).decode('utf-8')
     new_user = User(name=name, email=email, password=hashed_password)
     db.session.add(new_user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Registered by another worker since our cached check.
+        db.session.rollback()
+        return await render_template("login.html", error="Email already registered.", form='signup')
+    user_exists.cache_clear()
     session['user_id'] = new_user.id
     return redirect(url_for('courses'))
 
 @app.route("/login", methods=["POST"])
-def login():
-    email, password = request.form.get('email'), request.form.get('password')
-    user = User.query.filter_by(email=email).first()
-    if user and bcrypt.check_password_hash(user.password, password):
+async def login():
+    form = await request.form
+    email, password = form.get('email'), form.get('password')
+    user = await check_login(email, password)
+    if user:
         session['user_id'] = user.id
         return redirect(url_for('courses'))
     else:
-        return render_template("login.html", error="Invalid email or password.", form='login')
+        return await render_template("login.html", error="Invalid email or password.", form='login')
 
 @app.route("/logout")
-def logout():
+async def logout():
     session.clear()
     return redirect(url_for('index'))
 
 # --- AI API ENDPOINTS ---
 
+# Sent as the system instruction so each mentor call only carries the student's question.
+MENTOR_INSTRUCTION = ("You are an expert AI mentor for a course titled '{course_title}'. "
+                      "Answer the student's question with a helpful, clear, and encouraging explanation. "
+                      "If asked for more courses, suggest 1-2 specific online courses related to '{course_title}'.")
+
 @app.route("/mentor-chat", methods=["POST"])
-def mentor_chat():
+async def mentor_chat():
     if 'user_id' not in session: return jsonify({"error": "Not logged in"}), 401
-    data = request.get_json()
+    data = await request.get_json()
     question, course_title = data.get("question"), data.get("course_title")
     if not question or not course_title: return jsonify({"error": "Missing data"}), 400
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    prompt = (f"You are an expert AI mentor for a course titled '{course_title}'. "
-              f"A student asked: '{question}'. Provide a helpful, clear, and encouraging explanation. "
-              f"If asked for more courses, suggest 1-2 specific online courses related to '{course_title}'.")
-    response = model.generate_content(prompt)
-    return jsonify({"answer": response.text})
+    instruction = MENTOR_INSTRUCTION.format(course_title=course_title)
+    if semantic_cache: return sse_response(semantic_cache.stream(course_title, question, question, instruction))
+    return sse_response(llm_cache.stream(question, instruction))
 
 @app.route("/summarize-pdf", methods=["POST"])
-def summarize_pdf():
+async def summarize_pdf():
     if 'user_id' not in session: return jsonify({"error": "Not logged in"}), 401
-    if 'pdf_file' not in request.files: return jsonify({"error": "No file part"}), 400
-    file = request.files['pdf_file']
+    files = await request.files
+    if 'pdf_file' not in files: return jsonify({"error": "No file part"}), 400
+    file = files['pdf_file']
     if file.filename == '' or not file.filename.endswith('.pdf'): return jsonify({"error": "Invalid file"}), 400
+    if file.stream.read(len(PDF_MAGIC)) != PDF_MAGIC: return jsonify({"error": "Invalid file"}), 400
+    file.stream.seek(0)
+    spooled_path = None
     try:
-        pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-        full_text = "".join(page.get_text() for page in pdf_document)
-        pdf_document.close()
-        if not full_text.strip(): return jsonify({"summary": "This PDF contains no text to summarize."})
-        
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        prompt = f"Summarize the following document into key bullet points:\n\n{full_text}"
-        response = model.generate_content(prompt)
-        return jsonify({"summary": response.text})
+        # Spool the upload to disk so MuPDF opens it by path instead of from an in-memory copy.
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", dir=UPLOAD_DIR, delete=False) as pdf_file:
+            spooled_path = pdf_file.name
+            key = await asyncio.to_thread(spool_upload, file.stream, pdf_file)
+        summary = summary_cache.get(key)
+        if summary is not None:
+            os.remove(spooled_path)
+            return jsonify({"task_id": key, "status": "done", "summary": summary})
+        task_id = await asyncio.to_thread(enqueue_summary, spooled_path, key)
+        return jsonify({"task_id": task_id, "status": "pending"}), 202
     except Exception as e:
+        if spooled_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(spooled_path)
         return jsonify({"error": f"Error processing PDF: {str(e)}"}), 500
 
+@app.route("/summary/<task_id>")
+async def summary_status(task_id):
+    if 'user_id' not in session: return jsonify({"error": "Not logged in"}), 401
+    if not re.fullmatch(r"[0-9a-f]{32}", task_id): return jsonify({"error": "Unknown task"}), 404
+    summary = summary_cache.get(task_id)
+    if summary is not None: return jsonify({"status": "done", "summary": summary})
+    status = await asyncio.to_thread(summary_job_status, task_id)
+    if status is None: return jsonify({"error": "Unknown task"}), 404
+    if status in PENDING_JOB_STATUSES: return jsonify({"status": "pending"})
+    if status == JobStatus.CANCELED:
+        return jsonify({"status": "failed", "error": "No summary worker picked up this PDF; please try again later."})
+    return jsonify({"status": "failed", "error": "Summarization failed."})
+
 @app.route("/summarize", methods=["POST"])
-def summarize():
+async def summarize():
     if 'user_id' not in session: return jsonify({"error": "Not logged in"}), 401
-    data = request.get_json()
+    data = await request.get_json()
     text = data.get("text")
     if not text: return jsonify({"error": "No text provided"}), 400
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     prompt = f"Summarize the following text into a few key bullet points:\n\n{text}"
-    response = model.generate_content(prompt)
-    return jsonify({"summary": response.text})
+    return sse_response(llm_cache.stream(prompt))
 
 @app.route("/recommend-courses", methods=["POST"])
-def recommend_courses():
+async def recommend_courses():
     if 'user_id' not in session: return jsonify({"error": "Not logged in"}), 401
-    data = request.get_json()
+    data = await request.get_json()
     subject = data.get("subject")
     if not subject: return jsonify({"error": "Subject is required"}), 400
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     prompt = (f"Act as an expert student counselor. A user is interested in '{subject}'. "
               f"Suggest 3 relevant online courses from popular platforms. For each course, provide: "
               f"1. Title. 2. Platform. 3. A short description. 4. A Google search link. "
               f"Format the entire output in Markdown, with the title as a heading and the link as a clickable URL.")
-    response = model.generate_content(prompt)
-    return jsonify({"recommendation": response.text})
+    if semantic_cache: return sse_response(semantic_cache.stream("recommend-courses", subject, prompt))
+    return sse_response(llm_cache.stream(prompt))
 
 @app.route("/brainstorm-career", methods=["POST"])
-def brainstorm_career():
+async def brainstorm_career():
     if 'user_id' not in session: return jsonify({"error": "Not logged in"}), 401
-    data = request.get_json()
+    data = await request.get_json()
     skills = data.get("skills")
     if not skills: return jsonify({"error": "Skills are required"}), 400
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     prompt = (f"Act as a creative career coach. A user has skills/interests in '{skills}'. "
               f"Brainstorm 3-5 interesting career paths. For each one, provide a brief description of why it's a good match.")
-    response = model.generate_content(prompt)
-    return jsonify({"career_ideas": response.text})
-
-if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    return sse_response(llm_cache.stream(prompt))
@@ -0,0 +1,21 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+# Set SECRET_KEY in the environment so session cookies are valid across all workers.
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# The master checks settings before any worker imports app.py, so read .env here too.
+load_dotenv()
+if not os.getenv("SECRET_KEY"):
+    raise RuntimeError("SECRET_KEY is not set; each worker would sign sessions with its own random key.")
+
+bind = "0.0.0.0:8000"
+# Quart is an ASGI app, so each worker runs an asyncio event loop that keeps many
+# Gemini calls in flight at once (gevent greenlets would fight the loop for the sockets).
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = 2 * multiprocessing.cpu_count() + 1
+# Uvicorn workers heartbeat from their event loop, so this only restarts a worker whose loop
+# has been blocked this long; slow streaming responses don't count against it.
+timeout = 30
+keepalive = 65